@@ -1,5 +1,7 @@
-import json
 from datetime import datetime
+from typing import Optional, Union
+
+import orjson
 from airflow.operators.trigger_dagrun import TriggerDagRunOperator
 from airflow.providers.apache.kafka.operators.produce import ProduceToTopicOperator
 from airflow.decorators import dag
@@ -12,9 +14,13 @@ def get_project_id_branches():
         2622: 'master'
     }
 
-def producer_function(changed_repos: list):
-    for project_id in changed_repos:
-        yield json.dumps(project_id), json.dumps({'changed_repo_id': project_id})
+def producer_function(changed_repos: Optional[Union[list, str]]):
+    # The XCom value arrives as a list with native rendering, but as its JSON text otherwise
+    if isinstance(changed_repos, str):
+        changed_repos = orjson.loads(changed_repos)
+    payloads = [(orjson.dumps(project_id), orjson.dumps({'changed_repo_id': project_id}))
+                for project_id in changed_repos or []]
+    yield from payloads
 
 @dag(
     dag_id='gitlab_repo_monitoring_deferrable',
@@ -32,12 +38,14 @@ def gitlab_repo_monitoring_deferrable():
         task_id='gitlab_repo_sensor'
     )
 
+    # Producer settings (linger.ms, batch.size, compression.type, acks) are read from the extra of the kafka_conn_id
+    # connection, see the README for the recommended values.
     producer = ProduceToTopicOperator(
         task_id='produce_to_kafka',
         kafka_config_id='kafka_conn_id',
         topic='gitlab_repo_monitoring',
         producer_function=producer_function,
-        producer_function_args=["{{ ti.xcom_pull(key='changed_repos') }}"],
+        producer_function_args=["{{ ti.xcom_pull(key='changed_repos') | tojson }}"],
         trigger_rule='all_done'
     )
 
@@ -1,8 +1,12 @@
 from airflow import AirflowException
 from airflow.hooks.base import BaseHook
 import logging
+from typing import Dict, Optional, Tuple
+
 from utils.gitlab import Gitlab
 
+log = logging.getLogger(__name__)
+
 
 class GitlabHook(BaseHook):
     """A hook that provides an interface to the Gitlab API.
@@ -11,6 +15,10 @@ class GitlabHook(BaseHook):
 
     :param gitlab_conn_id: The connection ID to use for the hook.
     :type gitlab_conn_id: str
+    :param concurrency: The maximum number of async requests in flight at the same time.
+    :type concurrency: int
+    :param max_rate: The maximum number of async requests sent per second.
+    :type max_rate: float
     """
 
     conn_name_attr = "gitlab_conn_id"
@@ -18,23 +26,33 @@ class GitlabHook(BaseHook):
     conn_type = "gitlab"
     hook_name = "Gitlab"
 
-    def __init__(self, gitlab_conn_id: str = default_conn_name, *args, **kwargs) -> None:
+    # Gitlab clients shared by every hook of the process, keyed by connection id and request limits, so their HTTP
+    # sessions and limits are reused, along with the number of hooks using each of them
+    _CLIENTS: Dict[Tuple[str, int, float], Gitlab] = {}
+    _CLIENT_USERS: Dict[Gitlab, int] = {}
+
+    def __init__(self,
+                 gitlab_conn_id: str = default_conn_name,
+                 *args,
+                 concurrency: int = Gitlab.DEFAULT_CONCURRENCY,
+                 max_rate: float = Gitlab.DEFAULT_MAX_RATE,
+                 **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.gitlab_conn_id = gitlab_conn_id
-        self.client: Gitlab | None = None
-        self.get_conn()
+        self.concurrency = concurrency
+        self.max_rate = max_rate
+        self.client: Optional[Gitlab] = None
 
     def get_conn(self) -> Gitlab:
         """Gets the Gitlab object to interact with the API.
 
-        This method creates a new Gitlab object if it does not exist, or returns the existing one. It uses the connection details from the Airflow connection database to initialize the Gitlab object.
+        This method returns the Gitlab object cached for the connection ID, or creates a new one if it does not exist or the host or access token of the connection changed. It uses the connection details from the Airflow connection database to initialize the Gitlab object.
 
         :return: The Gitlab object to interact with the API.
         :rtype: Gitlab
 
         :raise: If the connection details are missing or invalid.
         """
-        logger = logging.getLogger(__name__)
         if self.client is not None:
             return self.client
 
@@ -48,7 +66,50 @@ class GitlabHook(BaseHook):
         if not host:
             raise AirflowException("Host is required to connect to Gitlab.")
 
-        self.client = Gitlab(url=host, private_token=access_token)
-        logger.info("Gitlab is initialized for host {}".format(host))
+        key = (self.gitlab_conn_id, self.concurrency, self.max_rate)
+        client = GitlabHook._CLIENTS.get(key)
+        if client is None or client.url != host or client.private_token != access_token:
+            client = Gitlab(url=host,
+                            private_token=access_token,
+                            concurrency=self.concurrency,
+                            max_rate=self.max_rate)
+            GitlabHook._CLIENTS[key] = client
+            log.info("Gitlab is initialized for host %s", host)
+
+        GitlabHook._CLIENT_USERS[client] = GitlabHook._CLIENT_USERS.get(client, 0) + 1
+        self.client = client
         return self.client
 
+    def close(self) -> None:
+        """Releases the Gitlab object of the hook, from synchronous code.
+
+        Its synchronous HTTP session is closed once no other hook of the process uses it anymore.
+        """
+        client = self.__release()
+        if client is not None:
+            client.close()
+
+    async def aclose(self) -> None:
+        """Releases the Gitlab object of the hook.
+
+        Its HTTP sessions are closed once no other hook of the process uses it anymore.
+        """
+        client = self.__release()
+        if client is not None:
+            await client.aclose()
+
+    def __release(self) -> Optional[Gitlab]:
+        """Gives up the Gitlab object of the hook, and returns it if this hook was its last user."""
+        client, self.client = self.client, None
+        if client is None:
+            return None
+
+        users = GitlabHook._CLIENT_USERS.pop(client, 1) - 1
+        if users > 0:
+            GitlabHook._CLIENT_USERS[client] = users
+            return None
+
+        key = (self.gitlab_conn_id, self.concurrency, self.max_rate)
+        if GitlabHook._CLIENTS.get(key) is client:
+            del GitlabHook._CLIENTS[key]
+        return client
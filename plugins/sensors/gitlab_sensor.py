@@ -1,13 +1,18 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List
 
+from airflow import AirflowException
 from airflow.models import BaseOperator
 from airflow.sensors.base import BaseSensorOperator
 from airflow.utils.context import Context
 from airflow.utils.decorators import apply_defaults
 
 from hooks.gitlab_hook import GitlabHook
-from triggers.gitlab_trigger import GitlabRepoChangedTrigger
+from triggers.gitlab_trigger import GitlabRepoChangedTrigger, GitlabWebhookTrigger
+from utils.gitlab import Gitlab
+
+log = logging.getLogger(__name__)
 
 
 class GitLabRepoChangeDetectionSensor(BaseSensorOperator):
@@ -33,7 +38,6 @@ class GitLabRepoChangeDetectionSensor(BaseSensorOperator):
         self.project_ids = project_ids
         self.gitlab_conn_id = gitlab_conn_id
         self.check_since = check_since
-        self.__log = logging.getLogger(__name__)
 
     def poke(self, context):
         """
@@ -45,15 +49,23 @@ class GitLabRepoChangeDetectionSensor(BaseSensorOperator):
         :rtype: bool
         """
         hook = GitlabHook(self.gitlab_conn_id)
-        self.__log.info("Checking for changes in GitLab repo with id {} since {}".format(self.project_ids, context[
-            "data_interval_start"]))
-        changed_repos = []
+        since = context["data_interval_start"].isoformat()
+        log.info("Checking for changes in GitLab repo with id %s since %s", self.project_ids, since)
+        gitlab = hook.get_conn()
+
+        def get_commits(project):
+            project_id, branch = project
+            return gitlab.sync_get_commits(project_id=project_id, branch_name=branch, since=since)
+
+        max_workers = max(1, min(len(self.project_ids), gitlab.concurrency))
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(get_commits, self.project_ids.items()))
+        finally:
+            hook.close()
 
-        for project_id, branch in self.project_ids.items():
-            commits = hook.get_conn().sync_get_commits(project_id=project_id, branch_name=branch,
-                                                       since=str(context["data_interval_start"]))
-            if commits.success and len(commits.commits) > 0:
-                changed_repos.append(project_id)
+        changed_repos = [project_id for project_id, commits in zip(self.project_ids, results)
+                         if commits.success and len(commits.commits) > 0]
 
         context["ti"].xcom_push("changed_repos", changed_repos)
         return len(changed_repos) > 0
@@ -73,6 +85,18 @@ class AwaitGitLabRepoChangeDetectionSensor(BaseOperator):
     :type check_interval: int
     :param xcom_push_key: The key for XCom push. Defaults to 'changed_repos' if not provided.
     :type xcom_push_key: str
+    :param concurrency: The maximum number of requests sent to GitLab at the same time. Defaults to 16.
+    :type concurrency: int
+    :param max_rate: The maximum number of requests sent to GitLab per second. Defaults to 10.
+    :type max_rate: float
+    :param webhook_url: The URL GitLab sends push events to. When set, the operator waits for push events instead of
+        polling GitLab. Defaults to None.
+    :type webhook_url: str
+    :param webhook_port: The port of the triggerer server receiving the push events. Defaults to 8090.
+    :type webhook_port: int
+    :param webhook_token_conn_id: The ID of the connection whose password is the secret token GitLab sends along the
+        push events. Required when webhook_url is set. Defaults to None.
+    :type webhook_token_conn_id: str
     """
 
     @apply_defaults
@@ -82,6 +106,11 @@ class AwaitGitLabRepoChangeDetectionSensor(BaseOperator):
                  check_runs: int = 10,
                  check_interval: int = 60,
                  xcom_push_key: str = None,
+                 concurrency: int = Gitlab.DEFAULT_CONCURRENCY,
+                 max_rate: float = Gitlab.DEFAULT_MAX_RATE,
+                 webhook_url: str = None,
+                 webhook_port: int = 8090,
+                 webhook_token_conn_id: str = None,
                  **kwargs) -> None:
         super().__init__(**kwargs)
         self.gitlab_conn_id = gitlab_conn_id
@@ -89,6 +118,13 @@ class AwaitGitLabRepoChangeDetectionSensor(BaseOperator):
         self.check_runs = check_runs
         self.check_interval = check_interval
         self.xcom_push_key = xcom_push_key if xcom_push_key else 'changed_repos'
+        self.concurrency = concurrency
+        self.max_rate = max_rate
+        self.webhook_url = webhook_url
+        self.webhook_port = webhook_port
+        self.webhook_token_conn_id = webhook_token_conn_id
+        if self.webhook_url and not self.webhook_token_conn_id:
+            raise AirflowException("webhook_token_conn_id is required to receive GitLab push events.")
 
     def execute(self, context: Context) -> Any:
         """
@@ -99,14 +135,32 @@ class AwaitGitLabRepoChangeDetectionSensor(BaseOperator):
         :return: The trigger event.
         :rtype: Any
         """
-        self.defer(
-            trigger=GitlabRepoChangedTrigger(
-                projects=self.projects,
-                changes_since=str(context["data_interval_start"]),
-                check_runs=self.check_runs,
-                check_interval=self.check_interval,
-                gitlab_conn_id=self.gitlab_conn_id),
-            method_name='execute_completed')
+        since = context["data_interval_start"].isoformat()
+        if self.webhook_url:
+            self.defer(
+                trigger=GitlabWebhookTrigger(
+                    projects=self.projects,
+                    changes_since=since,
+                    check_runs=self.check_runs,
+                    check_interval=self.check_interval,
+                    gitlab_conn_id=self.gitlab_conn_id,
+                    callback_url=self.webhook_url,
+                    listen_port=self.webhook_port,
+                    secret_token_conn_id=self.webhook_token_conn_id,
+                    concurrency=self.concurrency,
+                    max_rate=self.max_rate),
+                method_name='execute_completed')
+        else:
+            self.defer(
+                trigger=GitlabRepoChangedTrigger(
+                    projects=self.projects,
+                    changes_since=since,
+                    check_runs=self.check_runs,
+                    check_interval=self.check_interval,
+                    gitlab_conn_id=self.gitlab_conn_id,
+                    concurrency=self.concurrency,
+                    max_rate=self.max_rate),
+                method_name='execute_completed')
 
     def execute_completed(self, context, event=None):
         """
@@ -1,9 +1,43 @@
 import asyncio
+import hmac
 from typing import Any, Tuple, Dict
+from urllib import parse
 
+import orjson
+from aiohttp import web
+from airflow import AirflowException
+from airflow.hooks.base import BaseHook
 from airflow.triggers.base import BaseTrigger, TriggerEvent
 import logging
 from hooks.gitlab_hook import GitlabHook
+from utils.gitlab import Gitlab
+
+log = logging.getLogger(__name__)
+
+
+def _normalize_projects(projects: Dict) -> Dict:
+    # Project IDs come back as strings once the trigger kwargs are serialized, normalize them so the same project is
+    # never checked twice and the event carries integer IDs. Projects given by URL-encoded path are kept as they are.
+    return {int(project_id) if str(project_id).isdigit() else project_id: branch
+            for project_id, branch in projects.items()}
+
+
+async def _get_changed_repos(gitlab: Gitlab, projects: Dict, since: str) -> list:
+    # Batched GraphQL queries first, one REST request per project when they fail. Every changed project is collected,
+    # since the next DAG run only checks changes made after it was started.
+    changed_projects = await gitlab.async_get_changed_projects(projects, since)
+    if changed_projects is not None:
+        return [project_id for project_id in projects if project_id in changed_projects]
+
+    log.info("Batched query failed, checking projects one by one.")
+
+    async def get_commits(project_id, branch):
+        log.info("Checking branch %s of project %s commits since %s.", branch, project_id, since)
+        return project_id, await gitlab.async_get_commits(project_id=project_id, branch_name=branch, since=since)
+
+    results = await asyncio.gather(*[get_commits(project_id, branch) for project_id, branch in projects.items()])
+    return [project_id for project_id, commits_result in results
+            if commits_result.success and len(commits_result.commits) > 0]
 
 
 class GitlabRepoChangedTrigger(BaseTrigger):
@@ -20,22 +54,37 @@ class GitlabRepoChangedTrigger(BaseTrigger):
     :type changes_since: str
     :param check_runs: The maximum number of times to run the trigger before yielding an event.
     :type check_runs: int
-    :param check_interval (int): The number of seconds to wait between each run.
+    :param check_interval (int): The number of seconds to wait between each run. It doubles after every run
+        without changes, up to MAX_CHECK_INTERVAL seconds. The backoff starts over when the triggerer restarts,
+        since Airflow only serializes the trigger once when the task defers.
     :type check_interval: int
+    :param concurrency: The maximum number of requests sent to Gitlab at the same time. Defaults to 16.
+    :type concurrency: int
+    :param max_rate: The maximum number of requests sent to Gitlab per second. Defaults to 10.
+    :type max_rate: float
     """
 
+    # Upper bounds of the poll interval backoff
+    MAX_BACKOFF_EXPONENT = 6
+    MAX_CHECK_INTERVAL = 3600
+
     def __init__(self, gitlab_conn_id: str,
                  projects: Dict,
                  changes_since: str,
                  check_runs: int,
-                 check_interval: int) -> None:
+                 check_interval: int,
+                 concurrency: int = Gitlab.DEFAULT_CONCURRENCY,
+                 max_rate: float = Gitlab.DEFAULT_MAX_RATE) -> None:
         super().__init__()
         self.gitlab_conn_id = gitlab_conn_id
-        self.projects = projects
+        self.projects = _normalize_projects(projects)
         self.changes_since = changes_since
         self.check_runs = check_runs
         self.check_interval = check_interval
         self.runs = 0
+        self._empty_runs = 0
+        self.concurrency = concurrency
+        self.max_rate = max_rate
 
     def serialize(self) -> Tuple[str, Dict[str, Any]]:
         return (
@@ -45,7 +94,9 @@ class GitlabRepoChangedTrigger(BaseTrigger):
                 "projects": self.projects,
                 "changes_since": self.changes_since,
                 "check_runs": self.check_runs,
-                "check_interval": self.check_interval
+                "check_interval": self.check_interval,
+                "concurrency": self.concurrency,
+                "max_rate": self.max_rate
             },
         )
 
@@ -54,35 +105,263 @@ class GitlabRepoChangedTrigger(BaseTrigger):
 
         This method is a coroutine that runs in an infinite loop until either changes are detected or the maximum number of runs is reached.
         It uses the GitlabHook to get a connection to the Gitlab API and polls for commits in the specified
-        projects and branches. It logs the results of each check and appends the project IDs of the changed repositories to a list.
+        projects and branches with a single batched GraphQL query, falling back to concurrent REST requests when
+        the query fails. It logs the results of each check and appends the project IDs of the changed repositories to a list.
         It yields a TriggerEvent with the list of changed project IDs as the payload when the loop ends.
 
         :return: A TriggerEvent with the list of changed project IDs as the payload.
         :rtype: TriggerEvent
         """
-        log = logging.getLogger(__name__)
-        gitlab_hook = GitlabHook(self.gitlab_conn_id)
+        gitlab_hook = GitlabHook(self.gitlab_conn_id, concurrency=self.concurrency, max_rate=self.max_rate)
+        gitlab = gitlab_hook.get_conn()
+        log.info("hook initialized for gitlab trigger. start tracking for %s", self.projects)
+
+        try:
+            while True:
+                self.runs += 1
+                log.info("trying gitlab trigger for %s times out of %s", self.runs, self.check_runs)
+                changed_repos = await _get_changed_repos(gitlab, self.projects, self.changes_since)
+                for project_id in changed_repos:
+                    log.info("Changes detected for project %s", project_id)
+
+                log.info("changed repositories: %s", len(changed_repos))
+                log.info("+---------------------------------")
+                if len(changed_repos) > 0 or self.runs >= self.check_runs:
+                    yield TriggerEvent(changed_repos)
+                    return
+
+                self._empty_runs += 1
+                await asyncio.sleep(self.__get_sleep_interval())
+        finally:
+            await gitlab_hook.aclose()
+
+    def __get_sleep_interval(self) -> int:
+        # Exponential backoff on quiet repositories, the interval is reset as soon as a change is detected
+        exponent = min(self._empty_runs, GitlabRepoChangedTrigger.MAX_BACKOFF_EXPONENT)
+        return min(self.check_interval * (2 ** exponent), GitlabRepoChangedTrigger.MAX_CHECK_INTERVAL)
+
+
+class _PushSubscription:
+    """The projects and branches a GitlabWebhookTrigger waits push events for, and the ones received so far."""
+
+    def __init__(self, projects: Dict, secret_token: str) -> None:
+        self.projects = projects
+        self.secret_token = secret_token
+        self.changed_repos = []
+        self.changed = asyncio.Event()
+
+    def add_changed(self, project_id) -> None:
+        if project_id not in self.changed_repos:
+            self.changed_repos.append(project_id)
+        self.changed.set()
+
+    def push(self, project_keys: Tuple, ref: str) -> None:
+        for project_id in project_keys:
+            if project_id in self.projects and ref == f"refs/heads/{self.projects[project_id]}":
+                log.info("Push event received for project %s", project_id)
+                self.add_changed(project_id)
+
+
+class _PushEventListener:
+    """A server receiving the Gitlab push events of the triggerer process on a single port.
+
+    Every GitlabWebhookTrigger listening on the same host and port subscribes to the same server, which hands each
+    event to the subscriptions with the matching secret token. The server stops once its last subscription is removed.
+    """
+
+    _LISTENERS: Dict[Tuple[str, int], '_PushEventListener'] = {}
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self._subscriptions = []
+        self._runner: web.AppRunner | None = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    async def subscribe(host: str, port: int, subscription: _PushSubscription) -> '_PushEventListener':
+        """Adds a subscription to the listener of a host and port, starting its server if needed.
+
+        :raise OSError: If the server cannot listen on the host and port.
+        """
+        listener = _PushEventListener._LISTENERS.setdefault((host, port), _PushEventListener(host, port))
+        async with listener._lock:
+            if listener._runner is None:
+                await listener.__start()
+            listener._subscriptions.append(subscription)
+        return listener
+
+    async def unsubscribe(self, subscription: _PushSubscription) -> None:
+        """Removes a subscription, stopping the server when it was the last one."""
+        async with self._lock:
+            self._subscriptions.remove(subscription)
+            if not self._subscriptions and self._runner is not None:
+                await self._runner.cleanup()
+                self._runner = None
+
+    async def __start(self) -> None:
+        app = web.Application()
+        app.router.add_post('/{tail:.*}', self.__handle_push)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+        self._runner = runner
+        log.info("Listening for Gitlab push events on port %s", self.port)
+
+    async def __handle_push(self, request: web.Request) -> web.Response:
+        token = request.headers.get('X-Gitlab-Token') or ''
+        subscriptions = [subscription for subscription in self._subscriptions
+                         if hmac.compare_digest(token, subscription.secret_token)]
+        if not subscriptions:
+            return web.Response(status=401)
+
+        if request.headers.get('X-Gitlab-Event') == 'Push Hook':
+            payload = orjson.loads(await request.read())
+            if payload.get('total_commits_count', 0) > 0:
+                # Projects may be watched by ID or by URL-encoded path
+                path = (payload.get('project') or {}).get('path_with_namespace')
+                project_keys = (payload.get('project_id'), parse.quote(path, safe='') if path else None)
+                for subscription in subscriptions:
+                    subscription.push(project_keys, payload.get('ref'))
+        return web.Response()
+
+
+class GitlabWebhookTrigger(BaseTrigger):
+    """A trigger that waits for push events sent by Gitlab webhooks.
+
+    This trigger registers a push events webhook on the specified projects and waits for the events on an HTTP server
+    shared by the webhook triggers of the triggerer process, so no request is sent to Gitlab while the repositories
+    are quiet. Changes pushed before the webhooks were registered are caught by an initial check, and lost deliveries
+    by a final check when no event is received in time. If a webhook cannot be registered or the server cannot listen
+    on its port, it falls back to GitlabRepoChangedTrigger.
+    It yields a TriggerEvent with a list of changed project IDs once a push is received or check_runs * check_interval
+    seconds have passed.
+
+    :param gitlab_conn_id: The connection ID to use for the Gitlab hook.
+    :type gitlab_conn_id: str
+    :param projects: A dictionary of project IDs and branch names to monitor.
+    :type projects: dict
+    :param changes_since: The date and time to start checking for changes, in ISO 8601 format.
+    :type changes_since: str
+    :param check_runs: The number of check intervals to wait for a push event, and the runs of the polling fallback.
+    :type check_runs: int
+    :param check_interval: The number of seconds of a check interval.
+    :type check_interval: int
+    :param callback_url: The URL Gitlab sends the push events to, it must reach the listening server.
+    :type callback_url: str
+    :param secret_token_conn_id: The ID of the connection whose password is the secret token Gitlab sends along the
+        push events. Events without it are rejected. The token itself is not serialized with the trigger.
+    :type secret_token_conn_id: str
+    :param listen_port: The port of the server receiving the push events. Defaults to 8090.
+    :type listen_port: int
+    :param listen_host: The host of the server receiving the push events. Defaults to '0.0.0.0'.
+    :type listen_host: str
+    :param concurrency: The maximum number of requests sent to Gitlab at the same time. Defaults to 16.
+    :type concurrency: int
+    :param max_rate: The maximum number of requests sent to Gitlab per second. Defaults to 10.
+    :type max_rate: float
+    """
+
+    def __init__(self, gitlab_conn_id: str,
+                 projects: Dict,
+                 changes_since: str,
+                 check_runs: int,
+                 check_interval: int,
+                 callback_url: str,
+                 secret_token_conn_id: str,
+                 listen_port: int = 8090,
+                 listen_host: str = '0.0.0.0',
+                 concurrency: int = Gitlab.DEFAULT_CONCURRENCY,
+                 max_rate: float = Gitlab.DEFAULT_MAX_RATE) -> None:
+        super().__init__()
+        self.gitlab_conn_id = gitlab_conn_id
+        self.projects = _normalize_projects(projects)
+        self.changes_since = changes_since
+        self.check_runs = check_runs
+        self.check_interval = check_interval
+        self.callback_url = callback_url
+        self.listen_port = listen_port
+        self.listen_host = listen_host
+        self.secret_token_conn_id = secret_token_conn_id
+        self.concurrency = concurrency
+        self.max_rate = max_rate
+
+    def serialize(self) -> Tuple[str, Dict[str, Any]]:
+        return (
+            "triggers.gitlab_trigger.GitlabWebhookTrigger",
+            {
+                "gitlab_conn_id": self.gitlab_conn_id,
+                "projects": self.projects,
+                "changes_since": self.changes_since,
+                "check_runs": self.check_runs,
+                "check_interval": self.check_interval,
+                "callback_url": self.callback_url,
+                "secret_token_conn_id": self.secret_token_conn_id,
+                "listen_port": self.listen_port,
+                "listen_host": self.listen_host,
+                "concurrency": self.concurrency,
+                "max_rate": self.max_rate
+            },
+        )
+
+    async def run(self):
+        """Runs the trigger and waits for push events on the monitored branches.
+
+        :return: A TriggerEvent with the list of changed project IDs as the payload.
+        :rtype: TriggerEvent
+        """
+        gitlab_hook = GitlabHook(self.gitlab_conn_id, concurrency=self.concurrency, max_rate=self.max_rate)
+        secret_token = BaseHook.get_connection(self.secret_token_conn_id).password
+        if not secret_token:
+            raise AirflowException("A secret token is required to receive Gitlab push events.")
+
         gitlab = gitlab_hook.get_conn()
-        log.info("hook initialized for gitlab trigger. start tracking for {}".format(self.projects))
-        changed_repos = []
-
-        while True:
-            self.runs += 1
-            log.info("trying gitlab trigger for {} times out of {}".format(self.runs, self.check_runs))
-            for project_id, branch in self.projects.items():
-                log.info("Checking branch {} of project {} commits since {}.".format(
-                    branch, project_id, self.changes_since))
-                commits_result = await gitlab.async_get_commits(project_id=project_id,
-                                                                branch_name=branch,
-                                                                since=self.changes_since)
-
-                if commits_result.success and len(commits_result.commits) > 0:
-                    log.info("Changes detected for project {}".format(project_id))
-                    changed_repos.append(project_id)
-
-            log.info("changed repositories: {}".format(len(changed_repos)))
-            log.info("+---------------------------------")
-            if len(changed_repos) > 0 or self.runs >= self.check_runs:
-                yield TriggerEvent(changed_repos)
-
-            await asyncio.sleep(self.check_interval)
+        try:
+            registered = await asyncio.gather(*[
+                gitlab.async_ensure_webhook(project_id, self.callback_url, secret_token, branch)
+                for project_id, branch in self.projects.items()])
+            if not all(registered):
+                log.info("Webhooks could not be registered, polling Gitlab for changes instead.")
+                async for event in self.__poll():
+                    yield event
+                return
+
+            subscription = _PushSubscription(self.projects, secret_token)
+            try:
+                listener = await _PushEventListener.subscribe(self.listen_host, self.listen_port, subscription)
+            except OSError as e:
+                log.warning("Cannot listen for push events on port %s (%s), polling Gitlab for changes instead.",
+                            self.listen_port, e)
+                async for event in self.__poll():
+                    yield event
+                return
+
+            try:
+                for project_id in await _get_changed_repos(gitlab, self.projects, self.changes_since):
+                    subscription.add_changed(project_id)
+
+                try:
+                    await asyncio.wait_for(subscription.changed.wait(), timeout=self.check_runs * self.check_interval)
+                except asyncio.TimeoutError:
+                    log.info("No push event received in %s seconds, checking Gitlab for changes",
+                             self.check_runs * self.check_interval)
+                    for project_id in await _get_changed_repos(gitlab, self.projects, self.changes_since):
+                        subscription.add_changed(project_id)
+                yield TriggerEvent(subscription.changed_repos)
+            finally:
+                await listener.unsubscribe(subscription)
+        finally:
+            await gitlab_hook.aclose()
+
+    def __poll(self):
+        return GitlabRepoChangedTrigger(gitlab_conn_id=self.gitlab_conn_id,
+                                        projects=self.projects,
+                                        changes_since=self.changes_since,
+                                        check_runs=self.check_runs,
+                                        check_interval=self.check_interval,
+                                        concurrency=self.concurrency,
+                                        max_rate=self.max_rate).run()
@@ -1,9 +1,15 @@
-import json
-from typing import Dict, Any
+import asyncio
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from functools import lru_cache
+from typing import Dict, Any, Optional, Set, Tuple
 from urllib import parse as urlparser
 
-import aiohttp
+import httpx
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from aiolimiter import AsyncLimiter
 
 from utils.gitlab_result import CommitResult
 
@@ -11,7 +17,7 @@ from utils.gitlab_result import CommitResult
 class Gitlab:
     """A class that provides an async/sync interface to the Gitlab API.
 
-    This class uses the requests and aiohttp libraries to make HTTP requests to the Gitlab API and returns the response data as Python objects.
+    This class uses the requests and httpx libraries to make HTTP requests to the Gitlab API and returns the response data as Python objects.
 
     :param url: The base URL of the Gitlab server.
     :type url: str
@@ -19,21 +25,86 @@ class Gitlab:
     :type private_token: str
     :param connection_timeout: The timeout for the HTTP connections in seconds. Defaults to 10.
     :type connection_timeout: int
+    :param concurrency: The maximum number of async requests in flight at the same time. Defaults to 16.
+    :type concurrency: int
+    :param max_rate: The maximum number of async requests sent per time_period. Defaults to 10.
+    :type max_rate: float
+    :param time_period: The duration of the rate limit window in seconds. Defaults to 1.
+    :type time_period: float
     """
     # Constants for status codes
     STATUS_OK = 200
+    STATUS_CREATED = 201
+    STATUS_NOT_MODIFIED = 304
     STATUS_ERROR = 600
 
     # Constant for the API version
     API_VERSION = 'v4'
+
+    # Default limits of the async requests, to stay friendly to a shared Gitlab server
+    DEFAULT_CONCURRENCY = 16
+    DEFAULT_MAX_RATE = 10
+
+    # Maximum number of projects asked in a single GraphQL query, to stay under the query complexity limit
+    GRAPHQL_CHUNK_SIZE = 25
+
+    # Answers that will not change on a retry, so GraphQL is switched off for the life of the client
+    GRAPHQL_PERMANENT_STATUSES = frozenset({401, 403, 404})
+    GRAPHQL_SCHEMA_ERROR_CODES = frozenset({'undefinedField', 'undefinedType', 'argumentNotAccepted',
+                                            'missingRequiredArguments'})
+
     def __init__(self,
                  url: str,
                  private_token: str = None,
-                 connection_timeout: int = 10) -> None:
+                 connection_timeout: int = 10,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 max_rate: float = DEFAULT_MAX_RATE,
+                 time_period: float = 1) -> None:
         self.url = url
         self.private_token = private_token
         self.connection_timeout = connection_timeout
+        self.concurrency = concurrency
         self.api_url = urlparser.urljoin(url, f'/api/{Gitlab.API_VERSION}/')
+        self.graphql_url = urlparser.urljoin(url, '/api/graphql')
+        self._url_cache: Dict[Tuple[int, str], str] = {}
+        self._client: httpx.AsyncClient | None = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._limiter = AsyncLimiter(max_rate, time_period)
+        self._graphql_enabled = True
+        self._sync_session = requests.Session()
+        self._sync_session.headers.update(self.__get_auth_headers())
+        # The pool holds one connection per thread sending requests, instead of the 10 of the default adapter
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self._sync_session.mount('http://', adapter)
+        self._sync_session.mount('https://', adapter)
+
+    def __get_client(self) -> httpx.AsyncClient:
+        # The client (and its connection pool) is created lazily since it must be bound to a running event loop,
+        # then kept so connections are reused across polls. HTTP/2 multiplexes concurrent requests on one connection.
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                timeout=self.connection_timeout,
+                headers=self.__get_auth_headers(),
+                limits=httpx.Limits(max_connections=self.concurrency,
+                                    max_keepalive_connections=self.concurrency,
+                                    keepalive_expiry=75))
+        return self._client
+
+    def __get_auth_headers(self) -> Dict[str, str]:
+        # The token is sent as a header once per session rather than in every URL, so it never ends up in logs
+        return {'PRIVATE-TOKEN': self.private_token} if self.private_token else {}
+
+    async def aclose(self) -> None:
+        """Closes the underlying HTTP sessions and releases their pooled connections."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._sync_session.close()
+
+    def close(self) -> None:
+        """Closes the underlying synchronous HTTP session. The async one is closed by aclose."""
+        self._sync_session.close()
 
     async def async_get_commits(self, project_id: int, branch_name: str = 'master', since: str = None) -> CommitResult:
         """Gets the list of commits for a given project and branch asyncronously.
@@ -51,19 +122,127 @@ class Gitlab:
          • success: A boolean indicating whether the request was successful or not.
          • message: A string containing an error message if the request failed, or None if it succeeded.
          • status: An integer representing the HTTP status code of the response. Status 600 means exception
-         • commits: A list of dictionaries representing the commits, or an empty list if no commits are found.
+         • commits: A list of dictionaries representing the commits (at most one, or a None placeholder when only
+           the total count is known), or an empty list if no commits are found.
         :rtype: CommitResult
         """
         url = self.__get_commit_url(project_id, branch_name, since)
 
-        session_timeout = aiohttp.ClientTimeout(total=self.connection_timeout)
-        async with aiohttp.ClientSession(timeout=session_timeout) as session:
-            try:
-                async with session.get(url) as resp:
-                    text = await resp.text()
-                    return CommitResult.result_from_dict(Gitlab.__process_commit_response(resp.status, text))
-            except Exception as e:
-                return CommitResult.result_from_dict(Gitlab.get_exception_result(e))
+        try:
+            async with self._semaphore, self._limiter:
+                # The body (at most one commit) is always read so the connection goes back to the pool
+                resp = await self.__get_client().get(url, headers=Gitlab.__get_commit_headers(since))
+            # The total count header (when sent) is enough to know whether there are commits, skip the parsing then
+            total = resp.headers.get('X-Total')
+            data = orjson.loads(resp.content) if resp.status_code == Gitlab.STATUS_OK and total is None else None
+            return Gitlab.__process_commit_response(resp.status_code, total, data)
+        except Exception as e:
+            return CommitResult(status=Gitlab.STATUS_ERROR, message=str(e), success=False, commits=[])
+
+    async def async_get_changed_projects(self, projects: Dict[int, str], since: str) -> Optional[Set[int]]:
+        """Gets the IDs of the projects whose branch has commits since a given date, asyncronously.
+
+        This method sends batched queries to the GraphQL endpoint of the Gitlab API, asking for the last commit of up
+        to GRAPHQL_CHUNK_SIZE projects and branches at once instead of one REST request per project. A transient
+        failure (e.g. a 502, a 429 or a timeout) only makes this call return None. A permanent one (401, 403, 404 or
+        a schema error from an older Gitlab) also stops this client from using GraphQL again.
+        Projects given by their URL-encoded path instead of their ID are checked with REST requests.
+
+        :param projects: A dictionary of project IDs (or paths) and their corresponding branch names.
+        :type projects: Dict[int | str, str]
+        :param since: The date and time to start looking for commits, in ISO 8601 format.
+        :type since: str
+
+        :return: A set of the changed project IDs, or None if the query failed and the REST API should be used instead.
+        :rtype: Optional[Set[int]]
+        """
+        if not self._graphql_enabled:
+            return None
+
+        items = [(project_id, branch_name) for project_id, branch_name in projects.items() if type(project_id) is int]
+        paths = {project_id: branch_name for project_id, branch_name in projects.items() if type(project_id) is not int}
+        chunks = [dict(items[index:index + Gitlab.GRAPHQL_CHUNK_SIZE])
+                  for index in range(0, len(items), Gitlab.GRAPHQL_CHUNK_SIZE)]
+        results = await asyncio.gather(*[self.__async_get_changed_projects_chunk(chunk, since) for chunk in chunks])
+        if any(result is None for result in results):
+            return None
+
+        commits_results = await asyncio.gather(*[self.async_get_commits(project_id, branch_name, since)
+                                                 for project_id, branch_name in paths.items()])
+        changed_paths = {project_id for project_id, commits_result in zip(paths, commits_results)
+                         if commits_result.success and len(commits_result.commits) > 0}
+        return set().union(changed_paths, *results)
+
+    async def __async_get_changed_projects_chunk(self, projects: Dict[int, str], since: str) -> Optional[Set[int]]:
+        query, variables = Gitlab.__get_last_commits_query(projects)
+        headers = {'Authorization': f'Bearer {self.private_token}'} if self.private_token else None
+        try:
+            async with self._semaphore, self._limiter:
+                resp = await self.__get_client().post(self.graphql_url,
+                                                      json={'query': query, 'variables': variables},
+                                                      headers=headers)
+            if resp.status_code in Gitlab.GRAPHQL_PERMANENT_STATUSES:
+                self._graphql_enabled = False
+                return None
+            if resp.status_code != Gitlab.STATUS_OK:
+                return None
+            data = orjson.loads(resp.content)
+            if Gitlab.__is_schema_error(data):
+                self._graphql_enabled = False
+                return None
+            return Gitlab.__process_last_commits_response(projects, since, data)
+        except Exception:
+            return None
+
+    async def async_ensure_webhook(self,
+                                   project_id: int,
+                                   callback_url: str,
+                                   token: str = None,
+                                   branch_name: str = None) -> bool:
+        """Registers a push events webhook on a project asyncronously, or updates the one with the same URL.
+
+        This method lists the hooks of the /projects/{project_id}/hooks endpoint of the Gitlab API and creates a new one
+        when none of them points to the callback URL. An existing one is updated with the token (which Gitlab never
+        returns, so it cannot be compared) and push events enabled. Its branch filter is cleared when it targets
+        another branch, so the hook serves every watched branch of the project.
+
+        :param project_id: The ID of the project to register the webhook on.
+        :type project_id: int
+        :param callback_url: The URL Gitlab sends the push events to.
+        :type callback_url: str
+        :param token: The secret token Gitlab sends in the X-Gitlab-Token header of the events. Defaults to None.
+        :type token: str
+        :param branch_name: The branch to send push events for, all branches if None. Defaults to None.
+        :type branch_name: str
+
+        :return: True if the webhook exists or was created, False otherwise.
+        :rtype: bool
+        """
+        hooks_url = f"{self.api_url.rstrip('/')}/projects/{project_id}/hooks"
+        try:
+            async with self._semaphore, self._limiter:
+                resp = await self.__get_client().get(hooks_url, params={'per_page': 100})
+            if resp.status_code != Gitlab.STATUS_OK:
+                return False
+            existing = next((hook for hook in orjson.loads(resp.content) if hook.get('url') == callback_url), None)
+
+            hook = {'url': callback_url, 'push_events': True}
+            if token:
+                hook['token'] = token
+            if existing is None:
+                if branch_name:
+                    hook['push_events_branch_filter'] = branch_name
+                async with self._semaphore, self._limiter:
+                    resp = await self.__get_client().post(hooks_url, json=hook)
+                return resp.status_code == Gitlab.STATUS_CREATED
+
+            branch_filter = existing.get('push_events_branch_filter') or ''
+            hook['push_events_branch_filter'] = branch_filter if branch_filter in ('', branch_name) else ''
+            async with self._semaphore, self._limiter:
+                resp = await self.__get_client().put(f"{hooks_url}/{existing['id']}", json=hook)
+            return resp.status_code == Gitlab.STATUS_OK
+        except Exception:
+            return False
 
     def sync_get_commits(self, project_id: int, branch_name: str = 'master', since: str = None) -> CommitResult:
         """Gets the list of commits for a given project and branch syncronously.
@@ -81,68 +260,103 @@ class Gitlab:
          • success: A boolean indicating whether the request was successful or not.
          • message: A string containing an error message if the request failed, or None if it succeeded.
          • status: An integer representing the HTTP status code of the response. Status 600 means exception
-         • commits: A list of dictionaries representing the commits, or an empty list if no commits are found.
+         • commits: A list of dictionaries representing the commits (at most one, or a None placeholder when only
+           the total count is known), or an empty list if no commits are found.
         :rtype: CommitResult
         """
         url = self.__get_commit_url(project_id, branch_name, since)
         try:
-            resp = requests.get(url, timeout=self.connection_timeout)
-            text = resp.content.decode('utf')
-            return CommitResult.result_from_dict(Gitlab.__process_commit_response(resp.status_code, text))
+            resp = self._sync_session.get(url, headers=Gitlab.__get_commit_headers(since),
+                                          timeout=self.connection_timeout)
+            total = resp.headers.get('X-Total')
+            data = orjson.loads(resp.content) if resp.status_code == Gitlab.STATUS_OK and total is None else None
+            return Gitlab.__process_commit_response(resp.status_code, total, data)
         except Exception as e:
-            return CommitResult.result_from_dict(Gitlab.get_exception_result(e))
+            return CommitResult(status=Gitlab.STATUS_ERROR, message=str(e), success=False, commits=[])
 
 
     def __get_commit_url(self, project_id, branch_name, since):
-        url = self.api_url
-        url += f"{'' if url.endswith('/') else '/'}projects/{project_id}/repository/commits?ref_name={branch_name}"
-        if since:
-            url += f"&since={since}"
+        url = self._url_cache.get((project_id, branch_name))
+        if url is None:
+            # Only the presence of commits matters, so a single one is enough
+            url = f"{self.api_url.rstrip('/')}/projects/{project_id}/repository/commits?ref_name={branch_name}&per_page=1"
+            self._url_cache[(project_id, branch_name)] = url
+        return url + f"&since={Gitlab.__quote_since(since)}" if since else url
 
-        if self.private_token:
-            url += f'&private_token={self.private_token}'
-        return url
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def __quote_since(since: str) -> str:
+        # The same date is used for every project and poll, so it is only encoded once
+        return urlparser.quote(since)
 
     @staticmethod
-    def get_exception_result(exception: Exception) -> Dict[str, Any]:
-        result = Gitlab.__get_default_result()
-        Gitlab.__set_result(result,
-                            success=False,
-                            status=600,
-                            message=str(exception))
-        return result
+    @lru_cache(maxsize=32)
+    def __get_commit_headers(since: str) -> Optional[Dict[str, str]]:
+        if not since:
+            return None
+        try:
+            since_date = Gitlab.__parse_date(since)
+        except ValueError:
+            return None
+        return {'If-Modified-Since': format_datetime(since_date, usegmt=True)}
 
     @staticmethod
-    def __process_commit_response(status: int, text: str) -> dict:
-        result = Gitlab.__get_default_result()
-        if status == Gitlab.STATUS_OK:
-            text_json = json.loads(text)
-            if type(text_json) is list:
-                Gitlab.__set_result(result, commits=text_json)
-            else:
-                Gitlab.__set_result(result,
-                                    success=False,
-                                    message="result is not valid. result: {}".format(text_json),
-                                    commits=[])
-        else:
-            Gitlab.__set_result(result,
-                                status=Gitlab.STATUS_ERROR,
-                                message="Gitlab response is not succeed")
-        return result
+    def __parse_date(value: str) -> datetime:
+        # Dates without a timezone are taken as UTC, so they can be compared with the dates returned by Gitlab
+        date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        return date.astimezone(timezone.utc)
 
     @staticmethod
-    def __get_default_result(**kwargs):
-        message : str | None = None
-        result = {'success': True, 'message': message, 'status': 200}
-        result.update(kwargs)
-        return result
+    def __get_last_commits_query(projects: Dict[int, str]):
+        # One aliased field per project, the branch names are passed as variables to avoid escaping them in the query
+        declarations, fields, variables = [], [], {}
+        for index, (project_id, branch_name) in enumerate(projects.items()):
+            declarations.append(f'$ref{index}: String!')
+            fields.append(f'p{index}: projects(ids: ["gid://gitlab/Project/{int(project_id)}"]) '
+                          f'{{ nodes {{ repository {{ tree(ref: $ref{index}) {{ lastCommit {{ committedDate }} }} }} }} }}')
+            variables[f'ref{index}'] = branch_name
+        return f"query({', '.join(declarations)}) {{ {' '.join(fields)} }}", variables
 
     @staticmethod
-    def __set_result(result: dict, status: int = 200, success: bool = True, message: str = None, **kwargs) -> None:
-        result['status'] = status
-        result['message'] = message
-        result['success'] = success and status == 200
+    def __is_schema_error(data: Any) -> bool:
+        if not isinstance(data, dict) or not isinstance(data.get('errors'), list):
+            return False
+        for error in data['errors']:
+            extensions = error.get('extensions') if isinstance(error, dict) else None
+            if isinstance(extensions, dict) and extensions.get('code') in Gitlab.GRAPHQL_SCHEMA_ERROR_CODES:
+                return True
+        return False
 
-        result.update(kwargs)
+    @staticmethod
+    def __process_last_commits_response(projects: Dict[int, str], since: str, data: dict) -> Optional[Set[int]]:
+        if not isinstance(data, dict) or data.get('errors') or not isinstance(data.get('data'), dict):
+            return None
 
+        since_date = Gitlab.__parse_date(since) if since else None
+        changed_projects = set()
+        for index, project_id in enumerate(projects):
+            nodes = (data['data'].get(f'p{index}') or {}).get('nodes') or []
+            last_commit = (((nodes[0] if nodes else {}).get('repository') or {}).get('tree') or {}).get('lastCommit')
+            if not last_commit:
+                continue
+            if since_date is None or Gitlab.__parse_date(last_commit['committedDate']) >= since_date:
+                changed_projects.add(project_id)
+        return changed_projects
 
+    @staticmethod
+    def __process_commit_response(status: int, total: Optional[str], data: Any) -> CommitResult:
+        if status == Gitlab.STATUS_NOT_MODIFIED:
+            return CommitResult(status=Gitlab.STATUS_OK, message=None, success=True, commits=[])
+        if status == Gitlab.STATUS_OK and total is not None:
+            # Placeholder commit, callers only check whether there are commits or not
+            return CommitResult(status=Gitlab.STATUS_OK, message=None, success=True,
+                                commits=[None] if int(total) > 0 else [])
+        if status == Gitlab.STATUS_OK and type(data) is list:
+            return CommitResult(status=Gitlab.STATUS_OK, message=None, success=True, commits=data)
+        if status == Gitlab.STATUS_OK:
+            return CommitResult(status=Gitlab.STATUS_OK, message="result is not valid. result: {}".format(data),
+                                success=False, commits=[])
+        return CommitResult(status=Gitlab.STATUS_ERROR, message="Gitlab response is not succeed",
+                            success=False, commits=[])